@@ -0,0 +1,48 @@
+# cython: language_level=3
+#
+# Compiled weighted block accumulation, used when numba is not available.
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+cimport cython
+import numpy as np
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def weighted_blocks(const int[:, :] values, Py_ssize_t bits,
+                    const Py_ssize_t[:] block_top, const Py_ssize_t[:] block_bottom,
+                    const double[:] weight_top, const double[:] weight_bottom,
+                    const Py_ssize_t[:] block_left, const Py_ssize_t[:] block_right,
+                    const double[:] weight_left, const double[:] weight_right):
+    cdef Py_ssize_t height = values.shape[0]
+    cdef Py_ssize_t width = values.shape[1]
+    cdef Py_ssize_t x, y, top, bottom, left, right
+    cdef double value, w_top, w_bottom, w_left, w_right
+
+    # flat row-major accumulator, block (row, col) lives at row * bits + col
+    result = np.zeros(bits * bits, np.float64)
+    cdef double[:] blocks = result
+
+    for y in range(height):
+        top = block_top[y] * bits
+        bottom = block_bottom[y] * bits
+        w_top = weight_top[y]
+        w_bottom = weight_bottom[y]
+
+        for x in range(width):
+            value = values[y, x]
+            left = block_left[x]
+            right = block_right[x]
+            w_left = weight_left[x]
+            w_right = weight_right[x]
+
+            # add weighted pixel value to relevant blocks
+            blocks[top + left] += value * w_top * w_left
+            blocks[top + right] += value * w_top * w_right
+            blocks[bottom + left] += value * w_bottom * w_left
+            blocks[bottom + right] += value * w_bottom * w_right
+
+    return result
@@ -0,0 +1,99 @@
+# Compiled inner loops for the blockhash calculation.
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the accumulation falls back to Cython or NumPy
+    njit = None
+
+
+def _axis_weights(size, bits, even):
+    """
+    For every pixel index along one axis, return the two blocks it contributes to
+    (low, high) and the weight of its value in each of them.
+
+    Block boundaries lie at multiples of size / bits; they are located with integer
+    arithmetic on pixel * bits instead of float division and modulo.
+    """
+    pixels = np.arange(size, dtype=np.intp)
+    block_low = (pixels * bits) // size
+
+    if even:
+        # don't bother splitting, if the size evenly divides by bits
+        return block_low, block_low, np.ones(size), np.zeros(size)
+
+    # distance of the pixel's far edge past the last boundary, in units of 1 / bits pixel
+    offset = ((pixels + 1) * bits) % size
+    frac = (offset % bits) / bits
+
+    # the pixel straddles a boundary only if that boundary lies within it,
+    # which is never the case for the last pixel
+    inside = (offset >= bits) | (pixels + 1 == size)
+    block_high = np.where(inside, block_low, -((-pixels * bits) // size))
+
+    return block_low, block_high, 1 - frac, frac
+
+
+def _weighted_blocks_numpy(values, bits, block_top, block_bottom, weight_top, weight_bottom,
+                           block_left, block_right, weight_left, weight_right):
+    """
+    Vectorized accumulation for when neither numba nor the Cython extension is available:
+    each of the four (row block, column block) combinations is one weighted np.bincount
+    over the broadcast axis tables.
+    """
+    blocks = np.zeros(bits * bits, np.float64)
+
+    for rows, row_weights in ((block_top, weight_top), (block_bottom, weight_bottom)):
+        for cols, col_weights in ((block_left, weight_left), (block_right, weight_right)):
+            index = rows[:, np.newaxis] * bits + cols
+            weights = values * row_weights[:, np.newaxis] * col_weights
+            blocks += np.bincount(index.ravel(), weights=weights.ravel(), minlength=bits * bits)
+
+    return blocks
+
+
+_weighted_blocks = _weighted_blocks_numpy
+
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _weighted_blocks_numba(values, bits, block_top, block_bottom, weight_top, weight_bottom,
+                               block_left, block_right, weight_left, weight_right):
+        height, width = values.shape
+
+        # flat row-major accumulator, block (row, col) lives at row * bits + col
+        blocks = np.zeros(bits * bits, np.float64)
+
+        for y in range(height):
+            top = block_top[y] * bits
+            bottom = block_bottom[y] * bits
+            w_top = weight_top[y]
+            w_bottom = weight_bottom[y]
+            row = values[y]
+
+            for x in range(width):
+                value = row[x]
+                left = block_left[x]
+                right = block_right[x]
+                w_left = weight_left[x]
+                w_right = weight_right[x]
+
+                # add weighted pixel value to relevant blocks
+                blocks[top + left] += value * w_top * w_left
+                blocks[top + right] += value * w_top * w_right
+                blocks[bottom + left] += value * w_bottom * w_left
+                blocks[bottom + right] += value * w_bottom * w_right
+
+        return blocks
+
+    _weighted_blocks = _weighted_blocks_numba
+else:
+    # without numba, prefer the Cython build of the accumulation loop if it was compiled
+    try:
+        from ._accum import weighted_blocks as _weighted_blocks
+    except ImportError:
+        pass
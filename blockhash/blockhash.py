@@ -6,20 +6,38 @@
 # Copyright 2014 Commons Machinery http://commonsmachinery.se/
 # Distributed under an MIT license, please see LICENSE in the top dir.
 
-import math
+import logging
+import os
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
 from PIL import Image
 from typing import Tuple, Union, Iterable
 
+from ._kernels import _axis_weights, _weighted_blocks
+
+logger = logging.getLogger(__name__)
+
+# a block of fewer than 2**24 uint8 samples can't overflow a 32 bit sum
+UINT32_BLOCK_LIMIT = 2 ** 24
+
 
 def median(data):
-    data = sorted(data)
+    # quickselect the middle element(s) instead of sorting everything
+    data = np.asarray(data)
     length = len(data)
     if length % 2 == 0:
-        return (data[length // 2 - 1] + data[length // 2]) / 2.0
-        
-    return data[length // 2]
+        data = np.partition(data, [length // 2 - 1, length // 2])
+        return (data[length // 2 - 1].item() + data[length // 2].item()) / 2.0
+
+    return np.partition(data, length // 2)[length // 2].item()
 
 def total_value_rgba(im, data, x, y):
+    warnings.warn('total_value_rgba is deprecated, use pixel_values instead',
+                  DeprecationWarning, stacklevel=2)
     r, g, b, a = data[y * im.size[0] + x]
     if a == 0:
         return 765
@@ -27,71 +45,163 @@ def total_value_rgba(im, data, x, y):
         return r + g + b
 
 def total_value_rgb(im, data, x, y):
+    warnings.warn('total_value_rgb is deprecated, use pixel_values instead',
+                  DeprecationWarning, stacklevel=2)
     r, g, b = data[y * im.size[0] + x]
     return r + g + b
 
 def translate_blocks_to_bits(blocks, pixels_per_block):
     half_block_value = pixels_per_block * 256 * 3 / 2
 
-    # Compare medians across four horizontal bands
-    bandsize = len(blocks) // 4
-    for i in range(4):
-        m = median(blocks[i * bandsize : (i + 1) * bandsize])
-        for j in range(i * bandsize, (i + 1) * bandsize):
-            v = blocks[j]
+    # Compare medians across four horizontal bands, all found by a single partition
+    bands = np.asarray(blocks).reshape(4, -1)
+    bandsize = bands.shape[1]
+    k = bandsize // 2
+    if bandsize % 2 == 0:
+        p = np.partition(bands, [k - 1, k], axis=1)
+        m = (p[:, k - 1:k] + p[:, k:k + 1]) / 2.0
+    else:
+        m = np.partition(bands, k, axis=1)[:, k:k + 1]
 
-            # Output a 1 if the block is brighter than the median.
-            # With images dominated by black or white, the median may
-            # end up being 0 or the max value, and thus having a lot
-            # of blocks of value equal to the median.  To avoid
-            # generating hashes of all zeros or ones, in that case output
-            # 0 if the median is in the lower value space, 1 otherwise
-            blocks[j] = int(v > m or (abs(v - m) < 1 and m > half_block_value))
+    # Output a 1 if the block is brighter than the median.
+    # With images dominated by black or white, the median may
+    # end up being 0 or the max value, and thus having a lot
+    # of blocks of value equal to the median.  To avoid
+    # generating hashes of all zeros or ones, in that case output
+    # 0 if the median is in the lower value space, 1 otherwise
+    result = (bands > m) | ((np.abs(bands - m) < 1) & (m > half_block_value))
+    blocks[:] = result.astype(np.uint8).ravel().tolist()
 
 
 def bits_to_hexhash(bits):
-    return '{0:0={width}x}'.format(int(''.join([str(x) for x in bits]), 2), width = len(bits) // 4)
-
+    if len(bits) < 64:
+        # for tiny hashes folding the bits into an int beats the numpy call overhead
+        value = 0
+        for bit in bits:
+            value = (value << 1) | bit
+        return '{0:0={width}x}'.format(value, width = len(bits) // 4)
+
+    # left-pad to whole bytes so that packbits keeps the value of the bit string
+    width = len(bits) // 4
+    pad = -len(bits) % 8
+    bits = np.concatenate([np.zeros(pad, dtype=np.uint8), np.asarray(bits, dtype=np.uint8)])
+    hexhash = np.packbits(bits).tobytes().hex()
+
+    # like the format above, the result is at least len(bits) // 4 digits long, and longer
+    # only if the value needs more digits; drop the extra leading zeros of the padding
+    return hexhash.lstrip('0').zfill(width)
+
+
+@lru_cache(maxsize=8)
+def _target_mode(mode):
+    if mode == 'RGB' or mode == 'RGBA':
+        return mode
+    if mode in ('LA', 'La', 'PA', 'RGBa'):
+        return 'RGBA'
+    # 8 bit modes that Pillow converts to RGB without clipping any values
+    if mode in ('1', 'L', 'P', 'CMYK', 'YCbCr', 'RGBX'):
+        return 'RGB'
+
+    raise RuntimeError('Unsupported image mode: {}'.format(mode))
+
+def convert_image(im):
+    """
+    Convert an 8 bit image to RGB, or to RGBA if it has an alpha channel.
+    Indexed and grayscale images are hashed as RGB, ignoring any transparency key.
+    Other modes, e.g. 16 bit and float images, raise RuntimeError.
+    """
+    target_mode = _target_mode(im.mode)
+    if target_mode == im.mode:
+        return im
+
+    if im.mode == 'La':
+        # Pillow only converts premultiplied La through LA
+        im = im.convert('LA')
+
+    return im.convert(target_mode)
+
+def pixel_array(im):
+    """
+    Return the pixels of an image as a (height, width, channels) uint8 array,
+    with RGB or RGBA channels.
+    """
+    im = convert_image(im)
+    width, height = im.size
+    return np.frombuffer(im.tobytes(), dtype=np.uint8).reshape(height, width, len(im.mode))
+
+def transparent_mask(a):
+    """
+    Return a boolean mask of the fully transparent pixels of a (height, width, channels)
+    array, or None if there are none.
+    """
+    if a.shape[2] != 4:
+        return None
+
+    transparent = a[:, :, 3] == 0
+    return transparent if transparent.any() else None
+
+def channel_sums(a, transparent=None):
+    """
+    Return a 2D int array with the r + g + b sum of every pixel of a (height, width, channels)
+    array, and 765 (white) wherever the transparent mask is set.
+    """
+    # three whole-plane adds vectorize far better than a reduction over the short channel axis
+    values = a[:, :, 0].astype(np.int32)
+    values += a[:, :, 1]
+    values += a[:, :, 2]
+    if transparent is not None:
+        # patch in place rather than np.where, which would allocate another full-size array
+        values[transparent] = 765
+
+    return values
+
+def pixel_values(im):
+    """
+    Return a 2D int array with the r + g + b sum of every pixel of an image.
+    Fully transparent pixels count as white (765).
+    """
+    a = pixel_array(im)
+    return channel_sums(a, transparent_mask(a))
 
 def blockhash_even(im, bits):
-    if im.mode == 'RGBA':
-        total_value = total_value_rgba
-    elif im.mode == 'RGB':
-        total_value = total_value_rgb
-    else:
-        raise RuntimeError('Unsupported image mode: {}'.format(im.mode))
-
-    data = im.getdata()
+    im = convert_image(im)
     width, height = im.size
     blocksize_x = width // bits
     blocksize_y = height // bits
 
-    result = []
-
-    for y in range(bits):
-        for x in range(bits):
-            value = 0
-
-            for iy in range(blocksize_y):
-                for ix in range(blocksize_x):
-                    cx = x * blocksize_x + ix
-                    cy = y * blocksize_y + iy
-                    value += total_value(im, data, cx, cy)
+    # pixels beyond the last whole block are ignored
+    crop_x = blocksize_x * bits
+    crop_y = blocksize_y * bits
+
+    # only the alpha band is scanned to find out whether there are transparent pixels
+    alpha = im.getchannel('A') if im.mode == 'RGBA' else None
+
+    if alpha is not None and alpha.getextrema()[0] == 0:
+        # fully transparent pixels count as white, i.e. 255 in every color channel;
+        # the color bands are extracted, patched and box-summed one at a time, so besides
+        # the image only the transparency mask and one band (as a PIL image and as its
+        # uint8 copy) are held, instead of the interleaved image plus an int32 value array
+        transparent = np.asarray(alpha)[:crop_y, :crop_x] == 0
+        del alpha
+
+        sum_dtype = np.uint32 if blocksize_x * blocksize_y < UINT32_BLOCK_LIMIT else np.int64
+        block_sums = np.zeros((bits, bits), dtype=np.int64)
+        for band in 'RGB':
+            plane = np.array(im.getchannel(band))[:crop_y, :crop_x]
+            plane[transparent] = 255
+            block_sums += plane.reshape(bits, blocksize_y, bits, blocksize_x).sum(axis=(1, 3), dtype=sum_dtype)
+    else:
+        # box-sum the color channels of every block in one pass over the raw bytes
+        a = pixel_array(im)[:crop_y, :crop_x]
+        blocks = a.reshape(bits, blocksize_y, bits, blocksize_x, a.shape[2])
+        block_sums = blocks[..., :3].sum(axis=(1, 3, 4), dtype=np.int64)
 
-            result.append(value)
+    result = block_sums.ravel().tolist()
 
     translate_blocks_to_bits(result, blocksize_x * blocksize_y)
     return bits_to_hexhash(result)
 
 def blockhash(im, bits):
-    if im.mode == 'RGBA':
-        total_value = total_value_rgba
-    elif im.mode == 'RGB':
-        total_value = total_value_rgb
-    else:
-        raise RuntimeError('Unsupported image mode: {}'.format(im.mode))
-
-    data = im.getdata()
     width, height = im.size
 
     even_x = width % bits == 0
@@ -100,67 +210,45 @@ def blockhash(im, bits):
     if even_x and even_y:
         return blockhash_even(im, bits)
 
-    blocks = [[0 for col in range(bits)] for row in range(bits)]
+    values = pixel_values(im)
 
     block_width = float(width) / bits
     block_height = float(height) / bits
 
-    for y in range(height):
-        if even_y:
-            # don't bother dividing y, if the size evenly divides by bits
-            block_top = block_bottom = int(y // block_height)
-            weight_top, weight_bottom = 1, 0
-        else:
-            y_frac, y_int = math.modf((y + 1) % block_height)
-
-            weight_top = (1 - y_frac)
-            weight_bottom = (y_frac)
-
-            # y_int will be 0 on bottom/right borders and on block boundaries
-            if y_int > 0 or (y + 1) == height:
-                block_top = block_bottom = int(y // block_height)
-            else:
-                block_top = int(y // block_height)
-                block_bottom = int(-(-y // block_height)) # int(math.ceil(float(y) / block_height))
-
-        for x in range(width):
-            value = total_value(im, data, x, y)
-
-            if even_x:
-                # don't bother dividing x, if the size evenly divides by bits
-                block_left = block_right = int(x // block_width)
-                weight_left, weight_right = 1, 0
-            else:
-                x_frac, x_int = math.modf((x + 1) % block_width)
-
-                weight_left = (1 - x_frac)
-                weight_right = (x_frac)
-
-                # x_int will be 0 on bottom/right borders and on block boundaries
-                if x_int > 0 or (x + 1) == width:
-                    block_left = block_right = int(x // block_width)
-                else:
-                    block_left = int(x // block_width)
-                    block_right = int(-(-x // block_width)) # int(math.ceil(float(x) / block_width))
-
-            # add weighted pixel value to relevant blocks
-            blocks[block_top][block_left] += value * weight_top * weight_left
-            blocks[block_top][block_right] += value * weight_top * weight_right
-            blocks[block_bottom][block_left] += value * weight_bottom * weight_left
-            blocks[block_bottom][block_right] += value * weight_bottom * weight_right
-
-    result = [blocks[row][col] for row in range(bits) for col in range(bits)]
+    block_top, block_bottom, weight_top, weight_bottom = _axis_weights(height, bits, even_y)
+    block_left, block_right, weight_left, weight_right = _axis_weights(width, bits, even_x)
+
+    blocks = _weighted_blocks(values, bits, block_top, block_bottom, weight_top, weight_bottom,
+                              block_left, block_right, weight_left, weight_right)
+    result = blocks.tolist()
 
     translate_blocks_to_bits(result, block_width * block_height)
     return bits_to_hexhash(result)
 
 
+class _HashMap(object):
+    """
+    Lazily formats a hash as a 2D map of bits, only when a debug log record is emitted.
+    """
+
+    def __init__(self, image_blockhash: str, bits: int):
+        self.image_blockhash = image_blockhash
+        self.bits = bits
+
+    def __str__(self):
+        bin_hash = '{:0{width}b}'.format(int(self.image_blockhash, 16), width=self.bits ** 2)
+        mapping = [bin_hash[i:i+self.bits] for i in range(0, len(bin_hash), self.bits)]
+        return "\n" + "\n".join(mapping) + "\n"
+
+
 class ImageBlockhashCalculator(object):
 
-    def __init__(self, quick: bool = False, bits: int = 16, size: Tuple[int, int] = None, interpolation: int = 1, debug: bool = False):
+    def __init__(self, quick: bool = False, bits: int = 16, size: Tuple[int, int] = None, interpolation: int = 1, debug: bool = False,
+                 workers: int = None):
         """
         quick: Use quick hashing method. Default: False
         interpolation: Interpolation method: 1 - nearest neightbor, 2 - bilinear, 3 - bicubic, 4 - antialias. Default: 1'
+        workers: Number of threads hashing images concurrently. Default: number of CPUs
         """
         self.blockhash_method = None
         self.set_blockhash_method(quick)
@@ -169,6 +257,7 @@ class ImageBlockhashCalculator(object):
         self.size = self.__verify_size_param(size)
         self.interpolation = self.__parse_interpolation(interpolation)
         self.debug = debug
+        self.workers = workers or os.cpu_count() or 1
 
     def __verify_size_param(self, size: Union[Tuple[int, int], None]):
         if size is None:
@@ -193,27 +282,59 @@ class ImageBlockhashCalculator(object):
         self.blockhash_method = blockhash_even if quick else blockhash
 
 
-    def compute_blockhash(self, images: Iterable[Image.Image]):
-        for im in images:
-            # convert indexed/grayscale images to RGB
-            if im.mode == '1' or im.mode == 'L' or im.mode == 'P':
-                im = im.convert('RGB')
-            elif im.mode == 'LA':
-                im = im.convert('RGBA')
+    def _build_hasher(self):
+        """
+        Return a function hashing a single image or image path, with the calculator
+        settings bound as locals so the per-image work does no attribute lookups.
+        """
+        blockhash_method = self.blockhash_method
+        bits = self.bits
+        size = self.size
+        interpolation = self.interpolation
+
+        def hash_image(im: Union[str, os.PathLike, Image.Image]):
+            if isinstance(im, (str, os.PathLike)):
+                # images given by path are opened here and closed as soon as they are hashed
+                with Image.open(im) as opened:
+                    return hash_image(opened)
 
-            if self.size is not None:
-                im = im.resize(self.size, self.interpolation)
+            im = convert_image(im)
 
-            image_blockhash = self.blockhash_method(im, self.bits)
+            if size is not None:
+                im = im.resize(size, interpolation)
 
-            if self.debug:
-                bin_hash = '{:0{width}b}'.format(int(image_blockhash, 16), width=self.bits ** 2)
-                mapping = [bin_hash[i:i+self.bits] for i in range(0, len(bin_hash), self.bits)]
-                print("")
-                print("\n".join(mapping))
-                print("")
+            return blockhash_method(im, bits)
 
-            yield image_blockhash
+        return hash_image
+
+    def compute_blockhash(self, images: Iterable[Union[str, os.PathLike, Image.Image]]):
+        """
+        images: Opened images, or paths of image files to open
+        """
+        # settings are bound once per batch, changes to them apply from the next call
+        hash_image = self._build_hasher()
+        report = self.__report if self.debug else None
+        workers = self.workers
+
+        # decoding and the numeric work release the GIL, so images are hashed on a
+        # thread pool; only about `workers` images are in flight and results keep input order
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for im in images:
+                pending.append(executor.submit(hash_image, im))
+                if len(pending) > workers:
+                    image_blockhash = pending.popleft().result()
+                    yield report(image_blockhash) if report else image_blockhash
+
+            while pending:
+                image_blockhash = pending.popleft().result()
+                yield report(image_blockhash) if report else image_blockhash
+
+    def __report(self, image_blockhash: str):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s', _HashMap(image_blockhash, self.bits))
+
+        return image_blockhash
 
 
 def parse_image_paths(image_paths: Iterable[str]):
@@ -7,16 +7,12 @@
 # Distributed under an MIT license, please see LICENSE in the top dir.
 
 import argparse
-from typing import Iterable
-
-from PIL import Image
+import logging
+import sys
 
 from .blockhash import ImageBlockhashCalculator
 
 
-def parse_image_paths(image_paths: Iterable[str]):
-    return map(Image.open, image_paths)
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
@@ -29,14 +25,19 @@ if __name__ == '__main__':
     parser.add_argument('--interpolation', type=int, default=1, choices=[1, 2, 3, 4],
         help='Interpolation method: 1 - nearest neightbor, 2 - bilinear, 3 - bicubic, 4 - antialias. Default: 1')
     parser.add_argument('--debug', action='store_true',
-        help='Print hashes as 2D maps (for debugging)')
+        help='Log hashes as 2D maps (for debugging)')
+    parser.add_argument('--workers', type=int,
+        help='Number of images hashed concurrently. Default: number of CPUs')
     parser.add_argument('filenames', nargs='+')
 
     args = parser.parse_args()
 
+    if args.debug:
+        logging.basicConfig(stream=sys.stdout, format='%(message)s')
+        logging.getLogger('blockhash').setLevel(logging.DEBUG)
+
 
-    blockhasher = ImageBlockhashCalculator(args.quick, args.bits, args.size, args.interpolation, args.debug)
-    images = parse_image_paths(args.filenames)
-    hashes = blockhasher.compute_blockhash(images)
+    blockhasher = ImageBlockhashCalculator(args.quick, args.bits, args.size, args.interpolation, args.debug, args.workers)
+    hashes = blockhasher.compute_blockhash(args.filenames)
     for blockhash, filename in zip(hashes, args.filenames):
         print(f"{blockhash}  {filename}")
\ No newline at end of file
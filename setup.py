@@ -1,6 +1,17 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from distutils.core import setup, Extension
+
+try:
+    # the Cython accumulation loop is optional, it is only used when numba is not installed;
+    # optional=True lets the install go on with the Python kernel if it fails to compile
+    from Cython.Build import cythonize
+    ext_modules = cythonize([Extension('blockhash._accum', ['blockhash/_accum.pyx'], optional=True)])
+    for ext in ext_modules:
+        # cythonize() does not carry the flag over to the extensions it returns
+        ext.optional = True
+except ImportError:
+    ext_modules = []
 
 setup(
     name='imgblocks',
@@ -11,5 +22,6 @@ setup(
     license='MIT',
     scripts=['blockhash/blockhash_cmd.py'],
     packages=['blockhash'],
-    requires=['pillow'],
+    ext_modules=ext_modules,
+    requires=['pillow (>=4.3)', 'numpy (>=1.17)'],
 )
@@ -0,0 +1,121 @@
+# Perceptual image hash calculation tool based on algorithm descibed in
+# Block Mean Value Based Image Perceptual Hashing by Bian Yang, Fan Gu and Xiamu Niu
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+import unittest
+import PIL.Image as Image
+import gc, os, glob, pathlib, tempfile, warnings
+from unittest import mock
+
+from blockhash import blockhash as bh
+from blockhash.blockhash import ImageBlockhashCalculator, blockhash_even, pixel_values
+
+datadir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class CalculatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.filenames = sorted(glob.glob(os.path.join(datadir, '*.jpg')) +
+                                glob.glob(os.path.join(datadir, '*.png')))
+        # reference hashes of the default (non-quick) method with 16 bits
+        self.expected = {}
+        for fn in self.filenames:
+            with open(os.path.splitext(fn)[0] + '_16_2.txt') as f:
+                self.expected[fn] = f.readline().split()[0]
+
+    def test_order(self):
+        # more images than workers, so results come back from several batches
+        filenames = self.filenames * 3
+        hashes = list(ImageBlockhashCalculator(workers=4).compute_blockhash(filenames))
+        self.assertEqual(hashes, [self.expected[fn] for fn in filenames])
+
+    def test_quick(self):
+        # Babylonian.png and emptyBasket.png have transparent pixels and heights that
+        # 16 doesn't divide, so the band by band path and its crop are both covered
+        hashes = list(ImageBlockhashCalculator(quick=True).compute_blockhash(self.filenames))
+        expected = []
+        for fn in self.filenames:
+            with open(os.path.splitext(fn)[0] + '_16_1.txt') as f:
+                expected.append(f.readline().split()[0])
+        self.assertEqual(hashes, expected)
+
+    def test_quick_transparent_as_white(self):
+        # fully transparent pixels hash like opaque white ones, whatever their color
+        fn = os.path.join(datadir, 'emptyBasket.png')
+        with Image.open(fn) as im:
+            im = im.resize((331, 257))
+        transparent = im.getchannel('A').point(lambda v: 255 if v == 0 else 0)
+        self.assertEqual(transparent.getextrema()[1], 255)
+        im_white = im.copy()
+        im_white.paste((255, 255, 255, 255), mask=transparent)
+
+        calculator = ImageBlockhashCalculator(quick=True)
+        self.assertEqual(list(calculator.compute_blockhash([im])), list(calculator.compute_blockhash([im_white])))
+
+    def test_quick_transparent_block_sums(self):
+        # the band by band sums must equal box-sums of the per-pixel values, for both
+        # accumulator types and with the pixels beyond the last whole block cropped
+        with Image.open(os.path.join(datadir, 'Babylonian.png')) as im:
+            im.load()
+        width, height = im.size
+        blocksize_x, blocksize_y = width // 16, height // 16
+        values = pixel_values(im)[:blocksize_y * 16, :blocksize_x * 16]
+        expected = values.reshape(16, blocksize_y, 16, blocksize_x).sum(axis=(1, 3)).ravel().tolist()
+
+        for limit in (bh.UINT32_BLOCK_LIMIT, 0):
+            captured = []
+            with mock.patch.object(bh, 'UINT32_BLOCK_LIMIT', limit), \
+                    mock.patch.object(bh, 'translate_blocks_to_bits',
+                                      side_effect=lambda blocks, _: captured.append(list(blocks))), \
+                    mock.patch.object(bh, 'bits_to_hexhash'):
+                blockhash_even(im, 16)
+            self.assertEqual(captured, [expected], limit)
+
+    def test_workers(self):
+        single = list(ImageBlockhashCalculator(workers=1).compute_blockhash(self.filenames))
+        for workers in (2, 5, 32):
+            hashes = list(ImageBlockhashCalculator(workers=workers).compute_blockhash(self.filenames))
+            self.assertEqual(single, hashes)
+
+    def test_error_position(self):
+        missing = os.path.join(datadir, 'missing.jpg')
+        filenames = self.filenames[:3] + [missing] + self.filenames[3:]
+        hashes = ImageBlockhashCalculator(workers=2).compute_blockhash(filenames)
+
+        for fn in self.filenames[:3]:
+            self.assertEqual(next(hashes), self.expected[fn])
+        with self.assertRaises(FileNotFoundError):
+            next(hashes)
+
+    def test_paths(self):
+        fn = self.filenames[0]
+        with Image.open(fn) as im:
+            hashes = list(ImageBlockhashCalculator(workers=2).compute_blockhash([pathlib.Path(fn), im, fn]))
+
+        self.assertEqual(hashes, [self.expected[fn]] * 3)
+
+    def test_paths_closed(self):
+        # unlike single-frame files, multi-frame ones keep their file open after loading
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'frames.gif')
+            frames = [Image.new('RGB', (40, 30), color) for color in ('red', 'blue')]
+            frames[0].save(fn, save_all=True, append_images=frames[1:])
+
+            files = []
+            def tracking_open(*args, **kwargs):
+                im = open_image(*args, **kwargs)
+                files.append(im.fp)
+                return im
+
+            open_image = Image.open
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                with mock.patch.object(Image, 'open', tracking_open):
+                    list(ImageBlockhashCalculator(workers=2).compute_blockhash([pathlib.Path(fn), fn]))
+                gc.collect()
+
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(f.closed for f in files))
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
@@ -0,0 +1,44 @@
+# Perceptual image hash calculation tool based on algorithm descibed in
+# Block Mean Value Based Image Perceptual Hashing by Bian Yang, Fan Gu and Xiamu Niu
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+import unittest
+import PIL.Image as Image
+
+from blockhash.blockhash import ImageBlockhashCalculator, convert_image
+
+
+def transparent_image(mode):
+    im = Image.new('RGBA', (4, 4), (100, 100, 100, 0))
+    if mode == 'La':
+        # Pillow only produces premultiplied La from LA
+        im = im.convert('LA')
+    return im.convert(mode)
+
+
+class ConvertImageTestCase(unittest.TestCase):
+    def test_modes(self):
+        expected = {'RGB': 'RGB', 'RGBA': 'RGBA', '1': 'RGB', 'L': 'RGB', 'P': 'RGB', 'CMYK': 'RGB',
+                    'YCbCr': 'RGB', 'RGBX': 'RGB', 'LA': 'RGBA', 'La': 'RGBA', 'PA': 'RGBA', 'RGBa': 'RGBA'}
+        for mode, target_mode in expected.items():
+            im = transparent_image(mode)
+            self.assertEqual(convert_image(im).mode, target_mode, mode)
+
+        # converting high bit depth and float images to 8 bit would clip their values
+        for mode in ('I;16', 'I', 'F'):
+            im = Image.new('L', (4, 4), 100).convert(mode)
+            with self.assertRaisesRegex(RuntimeError, 'Unsupported image mode'):
+                convert_image(im)
+
+    def test_unsupported_mode_calculator(self):
+        im = Image.new('I;16', (64, 64), 40000)
+        with self.assertRaisesRegex(RuntimeError, 'Unsupported image mode: I;16'):
+            list(ImageBlockhashCalculator().compute_blockhash([im]))
+
+    def test_alpha_kept(self):
+        # transparency of alpha-carrying modes must survive, it turns pixels white in the hash
+        for mode in ('LA', 'La', 'PA', 'RGBa'):
+            im = transparent_image(mode)
+            self.assertEqual(convert_image(im).getpixel((0, 0))[3], 0, mode)
@@ -0,0 +1,28 @@
+# Perceptual image hash calculation tool based on algorithm descibed in
+# Block Mean Value Based Image Perceptual Hashing by Bian Yang, Fan Gu and Xiamu Niu
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+import unittest
+import random
+
+from blockhash.blockhash import bits_to_hexhash
+
+
+def reference_hexhash(bits):
+    # the original string based formatting
+    return '{0:0={width}x}'.format(int(''.join([str(x) for x in bits]), 2), width = len(bits) // 4)
+
+
+class BitsToHexhashTestCase(unittest.TestCase):
+    def test_reference_formatting(self):
+        rng = random.Random(0)
+        for length in range(4, 301):
+            patterns = [[rng.randint(0, 1) for _ in range(length)],
+                        [1] + [0] * (length - 1),
+                        [0] * (length - 1) + [1],
+                        [0] * length,
+                        [1] * length]
+            for bits in patterns:
+                self.assertEqual(bits_to_hexhash(bits), reference_hexhash(bits), length)
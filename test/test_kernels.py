@@ -0,0 +1,74 @@
+# Perceptual image hash calculation tool based on algorithm descibed in
+# Block Mean Value Based Image Perceptual Hashing by Bian Yang, Fan Gu and Xiamu Niu
+#
+# Copyright 2014 Commons Machinery http://commonsmachinery.se/
+# Distributed under an MIT license, please see LICENSE in the top dir.
+
+import unittest
+import numpy as np
+
+from blockhash import _kernels
+
+try:
+    from blockhash._accum import weighted_blocks as cython_weighted_blocks
+except ImportError:
+    cython_weighted_blocks = None
+
+
+class WeightedBlocksTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.bits = 16
+        # neither side divides evenly, so pixels straddling block boundaries are split
+        height, width = 251, 333
+        self.values = rng.integers(0, 766, (height, width)).astype(np.int32)
+        self.args = (_kernels._axis_weights(height, self.bits, False) +
+                     _kernels._axis_weights(width, self.bits, False))
+        self.expected = _kernels._weighted_blocks_numpy(self.values, self.bits, *self.args)
+
+    def assertSameBlocks(self, blocks):
+        np.testing.assert_allclose(blocks, self.expected, rtol=1e-12)
+
+    def test_numpy_totals(self):
+        # splitting a pixel between blocks never loses or adds value
+        self.assertAlmostEqual(self.expected.sum(), self.values.sum(), delta=1e-6)
+
+    @unittest.skipIf(_kernels.njit is None, 'numba is not installed')
+    def test_numba(self):
+        self.assertSameBlocks(_kernels._weighted_blocks_numba(self.values, self.bits, *self.args))
+
+    @unittest.skipIf(cython_weighted_blocks is None, 'the Cython extension is not built')
+    def test_cython(self):
+        self.assertSameBlocks(np.asarray(cython_weighted_blocks(self.values, self.bits, *self.args)))
+
+
+class AxisWeightsTestCase(unittest.TestCase):
+    def test_pixel_on_boundary(self):
+        # with 100 px and 12 bits the boundary between blocks 2 and 3 lies exactly at
+        # pixel 25, which belongs wholly to block 3; float division used to split it
+        low, high, weight_low, weight_high = _kernels._axis_weights(100, 12, False)
+        self.assertEqual((low[25], high[25], weight_low[25], weight_high[25]), (3, 3, 1.0, 0.0))
+
+        # pixel 16 straddles the boundary at 100 / 12 * 2 = 16.67: two thirds of it lie
+        # in block 1 and one third in block 2
+        self.assertEqual((low[16], high[16]), (1, 2))
+        self.assertAlmostEqual(weight_low[16], 2 / 3)
+        self.assertAlmostEqual(weight_high[16], 1 / 3)
+
+
+    def test_power_of_two_bits_unchanged(self):
+        # size / bits is exact in floating point for these, so the integer tables must
+        # equal those of the float division they replaced, keeping hashes unchanged
+        for bits in (4, 8, 16, 32):
+            for size in range(bits + 1, 300):
+                if size % bits == 0:
+                    continue
+                block_size = float(size) / bits
+                pixels = np.arange(size)
+                frac, whole = np.modf((pixels + 1) % block_size)
+                low = pixels // block_size
+                high = np.where((whole > 0) | (pixels + 1 == size), low, -(-pixels // block_size))
+
+                tables = _kernels._axis_weights(size, bits, False)
+                for actual, expected in zip(tables, (low, high, 1 - frac, frac)):
+                    np.testing.assert_array_equal(actual, expected)